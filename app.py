@@ -1,6 +1,7 @@
 # app.py
 from pathlib import Path
 import json
+import shutil
 import tempfile
 import streamlit as st
 
@@ -34,6 +35,13 @@ The agent will:
 
 ensure_dirs()
 
+@st.cache_resource(show_spinner=False)
+def load_retriever():
+    # One retriever (index + embedding model) per server, reused across reruns;
+    # failures aren't cached, so Analyze retries after references are added
+    from rag import build_or_load_vectorstore
+    return build_or_load_vectorstore()  # downloads on first run
+
 uploads = st.file_uploader(
     "Drag and drop files here",
     type=["docx"],
@@ -50,8 +58,7 @@ if analyze:
     # 1) Build/load the RAG index **on demand** (so the UI always loads)
     try:
         with st.spinner("Loading legal reference index (RAG) ..."):
-            from rag import build_or_load_vectorstore
-            retriever = build_or_load_vectorstore()  # downloads on first run
+            retriever = load_retriever()
     except Exception as e:
         st.error(
             "Could not load ADGM references automatically.\n\n"
@@ -65,17 +72,18 @@ if analyze:
         st.warning("Please upload at least one `.docx` file.")
         st.stop()
 
-    # 2) Persist uploads to temp files
-    with st.spinner("Analyzing documents..."):
+    # 2) Persist uploads to a per-run temp dir (removed once analysis finishes;
+    #    reviewed files and the report live under outputs/)
+    with st.spinner("Analyzing documents..."), tempfile.TemporaryDirectory(prefix="adgm_") as td:
         temp_files = []
         for uf in uploads:
-            tf = tempfile.NamedTemporaryFile(delete=False, suffix=".docx")
-            tf.write(uf.read())
-            tf.flush()
+            # unique staged name: uploads may share a name, and it also names the reviewed output
+            with tempfile.NamedTemporaryFile(dir=td, suffix=".docx", delete=False) as tf:
+                shutil.copyfileobj(uf, tf, length=1024 * 1024)  # stream, don't buffer the whole upload
             temp_files.append((uf.name, tf.name))
 
         # 3) Detect process and run analysis
-        process_guess = detect_process_from_docs([n for n, _ in temp_files])
+        process_guess = detect_process_from_docs(tuple(n for n, _ in temp_files))
         results = analyze_documents(
             uploaded_files=temp_files,
             retriever=retriever,
@@ -1,4 +1,6 @@
-from typing import List, Dict
+from functools import lru_cache
+from typing import List, Dict, Tuple
+from utils import build_keyword_automaton
 
 # Minimal mapping
 REQUIRED_DOCS: Dict[str, List[str]] = {
@@ -19,15 +21,22 @@ REQUIRED_DOCS: Dict[str, List[str]] = {
     ],
 }
 
-# Naive detection from filenames
-def detect_process_from_docs(filenames: List[str]) -> str:
-    joined = " ".join([fn.lower() for fn in filenames])
-    if any(k in joined for k in ["incorporation", "articles", "memorandum", "ubo", "register"]):
-        return "Company Incorporation"
-    if any(k in joined for k in ["employment", "contract", "hr"]):
-        return "Employment & HR"
+# Naive detection from filenames (keywords in priority order)
+PROCESS_KEYWORDS: Dict[str, List[str]] = {
+    "Company Incorporation": ["incorporation", "articles", "memorandum", "ubo", "register"],
+    "Employment & HR": ["employment", "contract", "hr"],
+}
+
+_PROCESS_AUTOMATON = build_keyword_automaton(
+    (k, process) for process, keys in PROCESS_KEYWORDS.items() for k in keys
+)
+
+@lru_cache(maxsize=32)
+def detect_process_from_docs(filenames: Tuple[str, ...]) -> str:
+    joined = " ".join(fn.lower() for fn in filenames)
+    hits = {process for _, (process, _) in _PROCESS_AUTOMATON.iter(joined)}
     # default
-    return "Company Incorporation"
+    return next((process for process in PROCESS_KEYWORDS if process in hits), "Company Incorporation")
 
 # Naive doc-type classifier 
 DOC_TYPE_KEYWORDS = {
@@ -41,9 +50,12 @@ DOC_TYPE_KEYWORDS = {
     "Employment Contract": ["employment contract", "standard employment contract"]
 }
 
+_DOC_TYPE_AUTOMATON = build_keyword_automaton(
+    (k, doc_type) for doc_type, keys in DOC_TYPE_KEYWORDS.items() for k in keys
+)
+
 def classify_doc_type(filename: str, text: str) -> str:
     hay = f"{filename.lower()} {text.lower()}"
-    for doc_type, keys in DOC_TYPE_KEYWORDS.items():
-        if any(k in hay for k in keys):
-            return doc_type
-    return "Unknown"
+    # Single pass over the text; priority still follows DOC_TYPE_KEYWORDS order
+    hits = {doc_type for _, (doc_type, _) in _DOC_TYPE_AUTOMATON.iter(hay)}
+    return next((doc_type for doc_type in DOC_TYPE_KEYWORDS if doc_type in hits), "Unknown")
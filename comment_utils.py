@@ -2,7 +2,55 @@ from docx import Document
 from docx.text.run import Run
 from lxml import etree
 from docx.oxml.shared import qn
-from datetime import datetime
+from docx.oxml.ns import nsmap, nsdecls
+from docx.oxml import parse_xml
+from docx.opc.constants import CONTENT_TYPE as CT, RELATIONSHIP_TYPE as RT
+from docx.opc.packuri import PackURI
+from docx.opc.part import XmlPart
+
+# Tag names resolved once; new roots declare the w: prefix so lxml doesn't emit ns0 aliases
+_W_NSMAP = {"w": nsmap["w"]}
+_W_COMMENT = qn('w:comment')
+_W_ID = qn('w:id')
+_W_P = qn('w:p')
+_W_R = qn('w:r')
+_W_T = qn('w:t')
+
+def _next_comment_id(doc_part, comments_el) -> str:
+    # Monotonic per-document counter, seeded past any comments already in the file
+    next_id = getattr(doc_part, "_adgm_next_cmt_id", None)
+    if next_id is None:
+        next_id = max((int(c.get(_W_ID, -1)) for c in comments_el.iter(_W_COMMENT)), default=-1) + 1
+    doc_part._adgm_next_cmt_id = next_id + 1
+    return str(next_id)
+
+def _comments_part(doc_part):
+    """
+    Return the document's comments part, creating word/comments.xml if needed
+    (python-docx 1.1 has no API for it). Memoized on the Document.
+    """
+    comments_part = getattr(doc_part, "_adgm_comments_part", None)
+    if comments_part is None:
+        document_part = doc_part.part
+        rel = next(
+            (rel for rel in document_part.rels.values()
+             if rel.reltype == RT.COMMENTS and not rel.is_external), None
+        )
+        comments_part = rel.target_part if rel is not None else None
+        if comments_part is not None and not isinstance(comments_part, XmlPart):
+            # python-docx loads an existing comments.xml as an opaque blob; swap in a
+            # parsed part so its comments are kept and new IDs are seeded past them
+            comments_part = XmlPart.load(
+                comments_part.partname, comments_part.content_type, comments_part.blob, comments_part.package
+            )
+            rel._target = comments_part
+        if comments_part is None:
+            partname = PackURI("/word/comments.xml")
+            element = parse_xml(f"<w:comments {nsdecls('w')}/>")
+            comments_part = XmlPart(partname, CT.WML_COMMENTS, element, document_part.package)
+            document_part.relate_to(comments_part, RT.COMMENTS)
+        doc_part._adgm_comments_part = comments_part
+    return comments_part
 
 def _add_comment(part, paragraph, text, author="ADGM Agent"):
     """
@@ -11,37 +59,28 @@ def _add_comment(part, paragraph, text, author="ADGM Agent"):
     """
     try:
         doc_part = part
-        comments_part = None
-        for rel in doc_part.part.rels.values():
-            if "comments" in rel.reltype:
-                comments_part = rel._target
-                break
-        if comments_part is None:
-            comments_part = doc_part.part.add_comments_part()
-            comments_part._element.append(etree.Element(qn('w:comments')))
-
-        comments_el = comments_part._element
-        # build comment
-        cmt_id = str(int(datetime.now().timestamp()))
-        cmt = etree.Element(qn('w:comment'), {qn('w:id'): cmt_id})
-        p = etree.SubElement(cmt, qn('w:p'))
-        r = etree.SubElement(p, qn('w:r'))
-        t = etree.SubElement(r, qn('w:t'))
+        comments_el = _comments_part(doc_part).element
+        # build comment (w:author is required by Word)
+        cmt_id = _next_comment_id(doc_part, comments_el)
+        cmt = etree.Element(_W_COMMENT, {_W_ID: cmt_id, qn('w:author'): author}, nsmap=_W_NSMAP)
+        p = etree.SubElement(cmt, _W_P)
+        r = etree.SubElement(p, _W_R)
+        t = etree.SubElement(r, _W_T)
         t.text = text
         comments_el.append(cmt)
 
         # mark range in body
         p_el = paragraph._p
-        start = etree.Element(qn('w:commentRangeStart'), {qn('w:id'): cmt_id})
-        end = etree.Element(qn('w:commentRangeEnd'), {qn('w:id'): cmt_id})
+        start = etree.Element(qn('w:commentRangeStart'), {_W_ID: cmt_id}, nsmap=_W_NSMAP)
+        end = etree.Element(qn('w:commentRangeEnd'), {_W_ID: cmt_id}, nsmap=_W_NSMAP)
         p_el.addprevious(start)
         p_el.addnext(end)
         # add reference
-        r_ref = etree.Element(qn('w:r'))
+        r_ref = etree.Element(_W_R, nsmap=_W_NSMAP)
         rpr = etree.SubElement(r_ref, qn('w:rPr'))
         ar = etree.SubElement(rpr, qn('w:rStyle'))
         ar.set(qn('w:val'), "CommentReference")
-        cref = etree.SubElement(r_ref, qn('w:commentReference'), {qn('w:id'): cmt_id})
+        cref = etree.SubElement(r_ref, qn('w:commentReference'), {_W_ID: cmt_id})
         p_el.append(r_ref)
         return True
     except Exception:
@@ -50,6 +89,10 @@ def _add_comment(part, paragraph, text, author="ADGM Agent"):
         run.font.highlight_color = 3  # yellow
         return False
 
+def add_comment_to_paragraph(doc: Document, paragraph, text: str):
+    # For callers that already hold the Paragraph (avoids rebuilding doc.paragraphs per comment)
+    return _add_comment(doc, paragraph, text)
+
 def add_comment_at_paragraph(doc: Document, para_idx: int, text: str):
     if para_idx < 0 or para_idx >= len(doc.paragraphs):
         return False
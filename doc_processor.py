@@ -1,42 +1,221 @@
-import json
+import os
+import pickle
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Tuple, Dict, Any
+from typing import List, Tuple, Dict, Any, Optional
+import diskcache
+import numpy as np
+import orjson
 from docx import Document
-from checklist import classify_doc_type, REQUIRED_DOCS
-from comment_utils import add_comment_at_paragraph
-from utils import ensure_dirs
+from docx.oxml.shared import qn
+from docx.text.paragraph import Paragraph
+from checklist import classify_doc_type, REQUIRED_DOCS, DOC_TYPE_KEYWORDS
+from comment_utils import add_comment_to_paragraph
+from utils import ensure_dirs, build_keyword_automaton
 
 # Simple rule patterns 
 BAD_JURISDICTION = ["uae federal court", "dubai courts", "onshore uae"]
 WEAK_LANGUAGE = ["may at its discretion", "best efforts", "commercially reasonable efforts"]
 MISSING_SIGN_KEYS = ["signature", "signed by", "authorised signatory", "authorized signatory", "date", "name"]
 
-def _extract_text(doc_path: str, max_chars=20000) -> str:
-    d = Document(doc_path)
-    text = "\n".join(p.text for p in d.paragraphs)
-    return text[:max_chars]
+# One automaton for all rule keywords, tagged by category, so each document is scanned once
+_RULES_AUTOMATON = build_keyword_automaton(
+    [(kw, "jurisdiction") for kw in BAD_JURISDICTION]
+    + [(kw, "weak") for kw in WEAK_LANGUAGE]
+    + [(kw, "sign") for kw in MISSING_SIGN_KEYS]
+)
+
+# Retrieval queries: one constant, two vary only by doc_type
+JUR_QUERY = "ADGM jurisdiction clause Companies Regulations courts venue"
+WEAK_QUERY_TEMPLATE = "binding language {doc_type} ADGM template clause shall must"
+SIGN_QUERY_TEMPLATE = "{doc_type} signature block ADGM template"
+
+# Retrieval cache: exact (doc_type, query) hits skip embedding + ANN entirely,
+# near-duplicate queries (cosine >= threshold) reuse the cached references.
+_RETR_CACHE_PATH = Path("data/.retrcache.pkl")
+_SEMANTIC_THRESHOLD = 0.9
+_RETR_CACHE: Dict[Tuple[str, str], list] = {}
+_SEM_KEYS: Optional[np.ndarray] = None  # (C, dim), L2-normalized query embeddings
+_SEM_REFS: List[list] = []
+_UNLOADED = object()
+_retr_cache_version = _UNLOADED  # retriever.version the in-memory cache belongs to
+_RETR_LOCK = threading.Lock()  # documents are analyzed on a thread pool
+_QUERY_EMBEDS: Dict[str, np.ndarray] = {}  # query -> L2-normalized embedding, kept while the retriever version is unchanged
+
+def _sync_retr_cache(retriever):
+    """
+    Make the caches match `retriever`: entries from another index build or
+    embedder (in memory or in the pickle) are discarded, never compared.
+    """
+    global _SEM_KEYS, _SEM_REFS, _retr_cache_version
+    version = getattr(retriever, "version", None)
+    if version == _retr_cache_version:
+        return
+    _retr_cache_version = version
+    _RETR_CACHE.clear()
+    _QUERY_EMBEDS.clear()
+    _SEM_KEYS, _SEM_REFS = None, []
+    if not _RETR_CACHE_PATH.exists():
+        return
+    try:
+        with open(_RETR_CACHE_PATH, "rb") as f:
+            state = pickle.load(f)
+        if state.get("version") != version:
+            print("[RAG] Discarding retrieval cache from a different index build.")
+            return
+        _RETR_CACHE.update(state["exact"])
+        _SEM_KEYS, _SEM_REFS = state["sem_keys"], state["sem_refs"]
+    except Exception as e:
+        print(f"[RAG] Ignoring unreadable retrieval cache: {e}")
+
+def _save_retr_cache():
+    try:
+        _RETR_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        # write-then-rename so a crash or concurrent reader never sees a partial pickle
+        tmp = _RETR_CACHE_PATH.with_name(_RETR_CACHE_PATH.name + ".tmp")
+        with open(tmp, "wb") as f:
+            pickle.dump({
+                "version": _retr_cache_version,
+                "exact": _RETR_CACHE,
+                "sem_keys": _SEM_KEYS,
+                "sem_refs": _SEM_REFS
+            }, f)
+        os.replace(tmp, _RETR_CACHE_PATH)
+    except Exception as e:
+        print(f"[RAG] Could not persist retrieval cache: {e}")
+
+def _semantic_lookup(vec: np.ndarray) -> Optional[list]:
+    if _SEM_KEYS is None or _SEM_KEYS.shape[1] != vec.shape[0]:
+        return None
+    sims = _SEM_KEYS @ vec
+    best = int(np.argmax(sims))
+    return _SEM_REFS[best] if sims[best] >= _SEMANTIC_THRESHOLD else None
+
+def _normalize_rows(vecs) -> np.ndarray:
+    vecs = np.asarray(vecs, dtype=np.float32)
+    return vecs / np.clip(np.linalg.norm(vecs, axis=-1, keepdims=True), 1e-12, None)
+
+def _prime_query_embeddings(retriever):
+    """
+    Embed every static query (for all known doc types) in one batch, so
+    retrievals during analysis never run the embedding model per call.
+    """
+    embeddings = getattr(retriever, "embeddings", None)
+    if embeddings is None:
+        return
+    with _RETR_LOCK:
+        _sync_retr_cache(retriever)
+        wanted = [
+            (dt, tpl.format(doc_type=dt))
+            for dt in list(DOC_TYPE_KEYWORDS) + ["Unknown"]
+            for tpl in (JUR_QUERY, WEAK_QUERY_TEMPLATE, SIGN_QUERY_TEMPLATE)
+        ]
+        # exact cache hits never need an embedding
+        todo = sorted({q for dt, q in wanted if q not in _QUERY_EMBEDS and (dt, q) not in _RETR_CACHE})
+        if todo:
+            _QUERY_EMBEDS.update(zip(todo, _normalize_rows(embeddings.embed_documents(todo))))
+
+def _query_embedding(embeddings, query: str) -> np.ndarray:
+    vec = _QUERY_EMBEDS.get(query)
+    if vec is None:
+        vec = _QUERY_EMBEDS[query] = _normalize_rows(embeddings.embed_query(query))
+    return vec
+
+def _retrieve_by_embed(retriever, vec: np.ndarray, k: int = 4) -> list:
+    return retriever.search_by_vector(vec, k)
+
+def _cached_retrieve(retriever, query: str, doc_type: str) -> list:
+    # Held across misses too, so concurrent documents never embed the same query twice
+    with _RETR_LOCK:
+        return _cached_retrieve_locked(retriever, query, doc_type)
+
+def _cached_retrieve_locked(retriever, query: str, doc_type: str) -> list:
+    global _SEM_KEYS
+    _sync_retr_cache(retriever)
+    key = (doc_type, query)
+    if key in _RETR_CACHE:
+        return _RETR_CACHE[key]
+
+    embeddings = getattr(retriever, "embeddings", None)
+    if embeddings is None:
+        # Unknown retriever type: exact-key caching only
+        refs = retriever.get_relevant_documents(query)
+    else:
+        # The same (usually pre-computed) vector drives both the cache lookup and the search
+        vec = _query_embedding(embeddings, query)
+        refs = _semantic_lookup(vec)
+        if refs is None:
+            refs = _retrieve_by_embed(retriever, vec)
+            _SEM_KEYS = vec[None, :] if _SEM_KEYS is None else np.vstack([_SEM_KEYS, vec])
+            _SEM_REFS.append(refs)
+
+    _RETR_CACHE[key] = refs
+    _save_retr_cache()
+    return refs
+
+# Per-document result cache, keyed by SHA-256 of (rules version, retriever version, filename, file bytes)
+_DOC_CACHE_DIR = Path("data/.docache")
+_DOC_CACHE_SCHEMA = 1  # bump when issue wording or comment placement changes
+_RULES_VERSION = hashlib.sha256(orjson.dumps([
+    _DOC_CACHE_SCHEMA, BAD_JURISDICTION, WEAK_LANGUAGE, MISSING_SIGN_KEYS, DOC_TYPE_KEYWORDS,
+    JUR_QUERY, WEAK_QUERY_TEMPLATE, SIGN_QUERY_TEMPLATE
+])).hexdigest()
+
+@lru_cache(maxsize=1)
+def _doc_cache() -> diskcache.Cache:
+    return diskcache.Cache(str(_DOC_CACHE_DIR))
+
+def _doc_cache_key(orig_name: str, path: str, retriever) -> str:
+    # Rule edits and index rebuilds (new citations) change the key; the filename
+    # is part of it because classify_doc_type looks at it
+    h = hashlib.sha256()
+    for part in (_RULES_VERSION, str(getattr(retriever, "version", None)), orig_name.lower()):
+        h.update(part.encode("utf-8") + b"\0")
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _iter_paragraphs(doc: Document):
+    # Same paragraphs (and parent) as doc.paragraphs, built lazily so callers can stop early
+    body = doc._body
+    for p in doc.element.body.iterchildren(qn("w:p")):
+        yield Paragraph(p, body)
+
+def _extract_text(doc: Document, max_chars=20000) -> str:
+    # Stop once max_chars is covered instead of materializing the whole document
+    parts, total = [], 0
+    for p in _iter_paragraphs(doc):
+        t = p.text
+        parts.append(t)
+        total += len(t) + 1
+        if total >= max_chars:
+            break
+    return "\n".join(parts)[:max_chars]
 
 def _find_red_flags(text: str, retriever, doc_type: str) -> List[Dict[str, Any]]:
-    lowers = text.lower()
+    hits = {hit for _, hit in _RULES_AUTOMATON.iter(text.lower())}
+    tags = {tag for tag, _ in hits}
     issues = []
 
     # 1) Wrong jurisdiction
-    for term in BAD_JURISDICTION:
-        if term in lowers:
-            refs = retriever.get_relevant_documents("ADGM jurisdiction clause Companies Regulations courts venue")
-            citation = refs[0].metadata.get("source", "ADGM Regulation") if refs else "ADGM Regulation"
-            issues.append({
-                "issue": "Jurisdiction references onshore UAE/Federal Courts",
-                "severity": "High",
-                "suggestion": "Update governing law and forum to ADGM Courts.",
-                "citation": citation
-            })
-            break
+    if "jurisdiction" in tags:
+        refs = _cached_retrieve(retriever, JUR_QUERY, doc_type)
+        citation = refs[0].metadata.get("source", "ADGM Regulation") if refs else "ADGM Regulation"
+        issues.append({
+            "issue": "Jurisdiction references onshore UAE/Federal Courts",
+            "severity": "High",
+            "suggestion": "Update governing law and forum to ADGM Courts.",
+            "citation": citation
+        })
 
     # 2) Weak language
     for term in WEAK_LANGUAGE:
-        if term in lowers:
-            refs = retriever.get_relevant_documents(f"binding language {doc_type} ADGM template clause shall must")
+        if ("weak", term) in hits:
+            refs = _cached_retrieve(retriever, WEAK_QUERY_TEMPLATE.format(doc_type=doc_type), doc_type)
             citation = refs[0].metadata.get("source", "ADGM Guidance/Template") if refs else "ADGM Guidance/Template"
             issues.append({
                 "issue": f"Ambiguous/weak obligation: '{term}'",
@@ -46,8 +225,8 @@ def _find_red_flags(text: str, retriever, doc_type: str) -> List[Dict[str, Any]]
             })
 
     # 3) Signing block present?
-    if not any(k in lowers for k in MISSING_SIGN_KEYS):
-        refs = retriever.get_relevant_documents(f"{doc_type} signature block ADGM template")
+    if "sign" not in tags:
+        refs = _cached_retrieve(retriever, SIGN_QUERY_TEMPLATE.format(doc_type=doc_type), doc_type)
         citation = refs[0].metadata.get("source", "ADGM Template") if refs else "ADGM Template"
         issues.append({
             "issue": "Missing or incomplete signatory section.",
@@ -58,24 +237,52 @@ def _find_red_flags(text: str, retriever, doc_type: str) -> List[Dict[str, Any]]
 
     return issues
 
-def _insert_comments(doc_path: str, issues: List[Dict[str, Any]]) -> str:
-    doc = Document(doc_path)
-    note_lines = []
-    for i, it in enumerate(issues):
-        note = f"{it['issue']} | Suggestion: {it['suggestion']} | Source: {it['citation']}"
-        note_lines.append(note)
-        # Add a comment near the first non-empty paragraph
-        target_idx = 0
-        for idx, p in enumerate(doc.paragraphs):
-            if p.text and len(p.text.strip()) > 3:
-                target_idx = idx
-                break
-        add_comment_at_paragraph(doc, target_idx, note)
-    out_name = Path(doc_path).stem + "_REVIEWED.docx"
-    out_path = Path("outputs/reviewed") / out_name
+def _insert_comments(doc: Document, original_path: str, issues: List[Dict[str, Any]]) -> str:
+    # Comments go near the first non-empty paragraph (else the first one); locate it once
+    target = first = None
+    for p in _iter_paragraphs(doc):
+        first = first or p
+        if p.text and len(p.text.strip()) > 3:
+            target = p
+            break
+    target = target or first
+    if target is not None:
+        for it in issues:
+            note = f"{it['issue']} | Suggestion: {it['suggestion']} | Source: {it['citation']}"
+            add_comment_to_paragraph(doc, target, note)
+    out_path = _reviewed_path(original_path)
     doc.save(out_path)
     return str(out_path)
 
+def _reviewed_path(original_path: str) -> Path:
+    return Path("outputs/reviewed") / (Path(original_path).stem + "_REVIEWED.docx")
+
+def _analyze_one(uploaded: Tuple[str, str], retriever) -> Dict[str, Any]:
+    orig_name, path = uploaded
+    key = _doc_cache_key(orig_name, path, retriever)
+    cached = _doc_cache().get(key)
+    if cached is not None:
+        # Identical upload: restore the reviewed copy, skip parsing and scanning
+        reviewed_path = None
+        if cached["reviewed"] is not None:
+            reviewed_path = _reviewed_path(path)
+            reviewed_path.write_bytes(cached["reviewed"])
+            reviewed_path = str(reviewed_path)
+        return {"name": orig_name, "type": cached["type"], "issues": cached["issues"], "reviewed_path": reviewed_path}
+
+    # Parsed once and reused for comments
+    doc = Document(path)
+    text = _extract_text(doc)
+    dtype = classify_doc_type(orig_name, text)
+    issues = _find_red_flags(text, retriever, dtype)
+    reviewed_path = _insert_comments(doc, path, issues) if issues else None
+    _doc_cache().set(key, {
+        "type": dtype,
+        "issues": issues,
+        "reviewed": Path(reviewed_path).read_bytes() if reviewed_path else None
+    })
+    return {"name": orig_name, "type": dtype, "issues": issues, "reviewed_path": reviewed_path}
+
 def analyze_documents(
     uploaded_files: List[Tuple[str, str]],
     retriever,
@@ -83,12 +290,11 @@ def analyze_documents(
 ) -> Dict[str, Any]:
     ensure_dirs()
 
-    # Classify doc type + extract text
-    doc_infos = []
-    for orig_name, path in uploaded_files:
-        text = _extract_text(path)
-        dtype = classify_doc_type(orig_name, text)
-        doc_infos.append({"name": orig_name, "path": path, "type": dtype, "text": text})
+    _prime_query_embeddings(retriever)
+
+    # Each document is parsed, scanned and commented independently
+    with ThreadPoolExecutor(max_workers=max(1, min(8, len(uploaded_files)))) as ex:
+        doc_infos = list(ex.map(lambda f: _analyze_one(f, retriever), uploaded_files))
 
     process = process_hint
     required = REQUIRED_DOCS.get(process, [])
@@ -98,19 +304,17 @@ def analyze_documents(
     issues_found = []
     reviewed_paths = []
     for info in doc_infos:
-        issues = _find_red_flags(info["text"], retriever, info["type"])
-        if issues:
-            reviewed_path = _insert_comments(info["path"], issues)
-            reviewed_paths.append({"original_name": info["name"], "path": reviewed_path})
-            for it in issues:
-                issues_found.append({
-                    "document": info["type"] if info["type"] != "Unknown" else info["name"],
-                    "section": "N/A",
-                    "issue": it["issue"],
-                    "severity": it["severity"],
-                    "suggestion": it["suggestion"],
-                    "citation": it["citation"]
-                })
+        if info["reviewed_path"]:
+            reviewed_paths.append({"original_name": info["name"], "path": info["reviewed_path"]})
+        for it in info["issues"]:
+            issues_found.append({
+                "document": info["type"] if info["type"] != "Unknown" else info["name"],
+                "section": "N/A",
+                "issue": it["issue"],
+                "severity": it["severity"],
+                "suggestion": it["suggestion"],
+                "citation": it["citation"]
+            })
 
     # Build structured report
     report = {
@@ -121,8 +325,8 @@ def analyze_documents(
         "issues_found": issues_found
     }
     report_path = Path("outputs/reports") / "report.json"
-    with open(report_path, "w", encoding="utf-8") as f:
-        json.dump(report, f, indent=2)
+    with open(report_path, "wb") as f:
+        f.write(orjson.dumps(report, option=orjson.OPT_INDENT_2))
 
     report["reviewed_paths"] = reviewed_paths
     report["report_path"] = str(report_path)
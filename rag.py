@@ -2,25 +2,50 @@
 from __future__ import annotations
 
 import re
+import uuid
+import json
 import time
 import shutil
+import textwrap
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
-from typing import List
+from typing import List, Dict, Any, Optional
 from urllib.parse import urlparse
 from urllib.request import Request, urlopen
 from urllib.error import HTTPError, URLError
 
-from langchain_community.vectorstores import Chroma
-from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.embeddings import HuggingFaceEmbeddings  # <-- use proper Embeddings object
+import faiss
+import numpy as np
+import onnxruntime as ort
+import pyarrow as pa
+import pyarrow.parquet as pq
+from transformers import AutoTokenizer
+from langchain_core.documents import Document as LangchainDocument
+from langchain_core.embeddings import Embeddings
+
+from ref_loader import load_reference_file
 
 # -----------------------------
 # Config
 # -----------------------------
 _EMBED_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
-_DB_DIR = Path("data/.chroma")
+_EMBED_BATCH_SIZE = 64
+_EMBED_MAX_LEN = 256
+_ONNX_DIR = Path("data/.onnx/all-MiniLM-L6-v2-int8")
+_ONNX_FILE = "model_quantized.onnx"
+_EMBEDDER_TAG = f"{_EMBED_MODEL_NAME}:onnx-int8"  # stored with the index; a mismatch forces a rebuild
+_DB_DIR = Path("data/.faiss")
+_INDEX_PATH = _DB_DIR / "hnsw.bin"
+_HNSW_M = 32
+_HNSW_EF_CONSTRUCTION = 80
+_HNSW_EF_SEARCH = 64
+_META_PATH = _DB_DIR / "meta.parquet"
+_CHUNK_SIZE = 1200
+_SENT_SPLIT_RE = re.compile(r"(?<=[.!?;:])\s+|\n{2,}")
 _REF_DIR = Path("data/reference")
+_FNAME_RE = re.compile(r"([^/]+\.(pdf|docx))", re.IGNORECASE)
+_SANITIZE_RE = re.compile(r"[^A-Za-z0-9._+-]")
 
 # Inline reference URLs
 REFERENCE_URLS: List[str] = [
@@ -44,7 +69,7 @@ REFERENCE_URLS: List[str] = [
 def _guess_filename_from_url(url: str) -> str:
     parsed = urlparse(url)
     path = parsed.path
-    m = re.search(r"([^/]+\.(pdf|docx))", path, flags=re.IGNORECASE)
+    m = _FNAME_RE.search(path)
     if m:
         base = m.group(1)
     else:
@@ -57,10 +82,18 @@ def _guess_filename_from_url(url: str) -> str:
         elif ".docx" in lower:
             base += ".docx"
 
-    base = re.sub(r"[^A-Za-z0-9._+-]", "_", base)
+    base = _SANITIZE_RE.sub("_", base)
     return base
 
 
+def _meta_path(dest: Path) -> Path:
+    return dest.with_name(dest.name + ".meta.json")
+
+
+def _is_cached(dest: Path) -> bool:
+    return dest.exists() and dest.stat().st_size > 0
+
+
 def _download_with_headers(url: str, dest: Path, retries: int = 3, backoff: float = 1.5):
     headers = {
         "User-Agent": (
@@ -72,68 +105,216 @@ def _download_with_headers(url: str, dest: Path, retries: int = 3, backoff: floa
         "Referer": "https://www.adgm.com/",
         "Accept-Language": "en-US,en;q=0.9",
     }
+    # Conditional GET: revalidate a cached copy via its ETag / Last-Modified sidecar
+    meta_path = _meta_path(dest)
+    if _is_cached(dest) and meta_path.exists():
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    tmp = dest.with_name(dest.name + ".part")
     last_err = None
     for i in range(retries):
         try:
             req = Request(url, headers=headers, method="GET")
-            with urlopen(req, timeout=30) as r, open(dest, "wb") as f:
+            with urlopen(req, timeout=30) as r, open(tmp, "wb") as f:
                 shutil.copyfileobj(r, f)
-            if dest.stat().st_size == 0:
+                meta = {"etag": r.headers.get("ETag"), "last_modified": r.headers.get("Last-Modified")}
+            if tmp.stat().st_size == 0:
                 raise IOError("Downloaded zero bytes")
+            tmp.replace(dest)
+            meta_path.write_text(json.dumps(meta), encoding="utf-8")
             return
-        except (HTTPError, URLError, IOError) as e:
+        except HTTPError as e:
+            if e.code == 304:
+                return  # cached copy is current
+            last_err = e
+            time.sleep(backoff ** i)
+        except (URLError, IOError) as e:
             last_err = e
             time.sleep(backoff ** i)
+    tmp.unlink(missing_ok=True)
     raise last_err
 
 
-def _download_if_needed(urls: List[str], outdir: Path) -> List[Path]:
+def _fetch(url: str, dest: Path):
+    try:
+        _download_with_headers(url, dest)
+    except Exception as e:
+        if not _is_cached(dest):
+            raise
+        print(f"[RAG] Refresh failed, keeping cached: {dest} ({e})")
+
+
+def _download_if_needed(urls: List[str], outdir: Path, refresh: bool = False) -> List[Path]:
+    """
+    Fetch missing reference files concurrently (network-bound, so threads suffice).
+    With refresh=True, cached files are revalidated with conditional requests.
+    """
     outdir.mkdir(parents=True, exist_ok=True)
-    paths: List[Path] = []
-    for url in urls:
-        name = _guess_filename_from_url(url)
-        dest = outdir / name
-        if not dest.exists() or dest.stat().st_size == 0:
+    targets = [(url, outdir / _guess_filename_from_url(url)) for url in urls]
+    needed = []
+    for url, dest in targets:
+        if refresh or not _is_cached(dest):
             print(f"[RAG] Downloading: {url} -> {dest}")
-            _download_with_headers(url, dest)
+            needed.append((url, dest))
         else:
             print(f"[RAG] Using cached: {dest}")
-        paths.append(dest)
-    return paths
+    if needed:
+        with ThreadPoolExecutor(max_workers=min(8, len(needed))) as ex:
+            list(ex.map(lambda ud: _fetch(*ud), needed))
+    return [dest for _, dest in targets]
 
 
 def _load_reference_docs(ref_paths: List[Path]):
-    docs = []
-    for p in ref_paths:
-        try:
-            if p.suffix.lower() == ".pdf":
-                docs.extend(PyPDFLoader(str(p)).load())
-            elif p.suffix.lower() == ".docx":
-                docs.extend(Docx2txtLoader(str(p)).load())
-            else:
-                print(f"[RAG] Skipping unsupported file type: {p}")
-        except Exception as e:
-            print(f"[RAG] Failed to load {p}: {e}")
-    return docs
+    return [d for p in ref_paths for d in load_reference_file(p)]
+
+
+def _split_docs(docs, chunk_size: int = _CHUNK_SIZE, overlap_sents: int = 1) -> List[Dict[str, Any]]:
+    """
+    Sentence-aware chunking: packs whole sentences up to ~chunk_size chars,
+    carrying the last sentence(s) over as overlap. Duplicate chunks (templates
+    repeat boilerplate heavily) are dropped. Returns flat metadata rows.
+    """
+    rows: List[Dict[str, Any]] = []
+    seen = set()
+
+    def emit(sents, meta):
+        text = " ".join(sents)
+        key = " ".join(text.lower().split())
+        if key and key not in seen:
+            seen.add(key)
+            rows.append({"text": text, "source": meta.get("source"), "page": meta.get("page")})
+
+    for d in docs:
+        sents = []
+        for s in _SENT_SPLIT_RE.split(d.page_content):
+            s = " ".join(s.split())
+            sents.extend(textwrap.wrap(s, chunk_size) if len(s) > chunk_size else [s] if s else [])
+        buf: List[str] = []
+        size = 0
+        for sent in sents:
+            if buf and size + len(sent) > chunk_size:
+                emit(buf, d.metadata)
+                buf = buf[-overlap_sents:] if overlap_sents else []
+                size = sum(len(b) + 1 for b in buf)
+                while buf and size + len(sent) > chunk_size:  # overlap must not overflow the chunk
+                    size -= len(buf.pop(0)) + 1
+            buf.append(sent)
+            size += len(sent) + 1
+        if buf:
+            emit(buf, d.metadata)
+    return rows
 
 
-def _split_docs(docs):
-    splitter = RecursiveCharacterTextSplitter(chunk_size=1200, chunk_overlap=150)
-    return splitter.split_documents(docs)
+def _export_quantized_model(out_dir: Path):
+    # One-time export to ONNX + dynamic int8 quantization (VNNI dot-product kernels on CPU)
+    from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
 
+    print(f"[RAG] Exporting {_EMBED_MODEL_NAME} to ONNX int8 (one-time) -> {out_dir}")
+    out_dir.mkdir(parents=True, exist_ok=True)
+    model = ORTModelForFeatureExtraction.from_pretrained(_EMBED_MODEL_NAME, export=True)
+    AutoTokenizer.from_pretrained(_EMBED_MODEL_NAME).save_pretrained(out_dir)
+    qconfig = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+    ORTQuantizer.from_pretrained(model).quantize(save_dir=out_dir, quantization_config=qconfig)
 
+
+class ORTEmbeddings(Embeddings):
+    """
+    all-MiniLM-L6-v2 on ONNX Runtime (int8, CPU). Mean-pools token states
+    and L2-normalizes, matching the sentence-transformers pipeline.
+    """
+
+    def __init__(self, model_dir: Path = _ONNX_DIR, batch_size: int = _EMBED_BATCH_SIZE):
+        if not (model_dir / _ONNX_FILE).exists():
+            _export_quantized_model(model_dir)
+        self.tokenizer = AutoTokenizer.from_pretrained(str(model_dir))
+        self.session = ort.InferenceSession(str(model_dir / _ONNX_FILE), providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.batch_size = batch_size
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        out = []
+        for i in range(0, len(texts), self.batch_size):
+            enc = self.tokenizer(
+                texts[i:i + self.batch_size], padding=True, truncation=True,
+                max_length=_EMBED_MAX_LEN, return_tensors="np",
+            )
+            feeds = {k: v.astype(np.int64) for k, v in enc.items() if k in self.input_names}
+            hidden = self.session.run(None, feeds)[0]
+            mask = enc["attention_mask"][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            out.append(pooled.astype(np.float32))
+        return np.vstack(out) if out else np.zeros((0, 0), dtype=np.float32)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.encode(list(texts)).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.encode([text])[0].tolist()
+
+
+@lru_cache(maxsize=1)
 def _get_embeddings():
-    # Proper LangChain Embeddings object (fixes the '_type' issue)
-    return HuggingFaceEmbeddings(model_name=_EMBED_MODEL_NAME)
+    # Process-wide singleton: every retriever and analysis thread shares one ONNX session
+    return ORTEmbeddings()
+
+
+def _read_index(path: Path):
+    try:
+        return faiss.read_index(str(path), faiss.IO_FLAG_MMAP)
+    except RuntimeError:
+        # not every index type supports mmap; fall back to a regular load
+        return faiss.read_index(str(path))
+
+
+class FaissRetriever:
+    """
+    Minimal retriever over a FAISS HNSW inner-product index.
+    Vectors are L2-normalized, so inner product == cosine similarity.
+    """
+
+    def __init__(self, index, metadata: List[Dict[str, Any]], embeddings, version: str, k: int = 4):
+        self.index = index
+        # embedder + build id; callers key derived caches on it
+        self.version = version
+        if hasattr(index, "hnsw"):
+            index.hnsw.efSearch = max(_HNSW_EF_SEARCH, k)
+        self.metadata = metadata
+        self.embeddings = embeddings
+        self.k = k
+
+    def search_by_vector(self, vec: np.ndarray, k: Optional[int] = None) -> List[LangchainDocument]:
+        q = np.ascontiguousarray(vec, dtype=np.float32).reshape(1, -1)
+        faiss.normalize_L2(q)
+        _, idx = self.index.search(q, k or self.k)
+        docs = []
+        for i in idx[0]:
+            if i < 0:
+                continue
+            row = self.metadata[i]
+            meta = {"source": row["source"]}
+            if row.get("page") is not None:
+                meta["page"] = row["page"]
+            docs.append(LangchainDocument(page_content=row["text"], metadata=meta))
+        return docs
+
+    def get_relevant_documents(self, query: str) -> List[LangchainDocument]:
+        return self.search_by_vector(np.asarray(self.embeddings.embed_query(query), dtype=np.float32))
+
 
 # -----------------------------
 # Public API
 # -----------------------------
 def build_or_load_vectorstore(force_rebuild: bool = False):
     """
-    Returns a LangChain Retriever over a Chroma vector store.
+    Returns a retriever over a FAISS index of the ADGM references.
     - Downloads ADGM references (cached to data/reference/)
-    - Builds a persistent Chroma index in data/.chroma on first run
+    - Builds the index in data/.faiss on first run (hnsw.bin + meta.parquet)
     - Reuses the index on subsequent runs unless force_rebuild=True
     """
     _DB_DIR.mkdir(parents=True, exist_ok=True)
@@ -141,16 +322,22 @@ def build_or_load_vectorstore(force_rebuild: bool = False):
 
     if not force_rebuild:
         try:
-            # IMPORTANT: pass the same embeddings when loading
-            vs = Chroma(persist_directory=str(_DB_DIR), embedding_function=embeddings)
-            _ = vs.similarity_search("ADGM", k=1)  # smoke test
-            print("[RAG] Loaded existing Chroma index.")
-            return vs.as_retriever(search_kwargs={"k": 4})
+            index = _read_index(_INDEX_PATH)
+            table = pq.read_table(_META_PATH)
+            tag = (table.schema.metadata or {}).get(b"embedder", b"").decode()
+            if tag != _EMBEDDER_TAG:
+                raise ValueError(f"index was built with '{tag or 'unknown'}' embeddings")
+            build_id = (table.schema.metadata or {}).get(b"build_id", b"").decode()
+            metadata = table.to_pylist()
+            if index.ntotal != len(metadata):
+                raise ValueError(f"index has {index.ntotal} vectors but {len(metadata)} metadata rows")
+            print("[RAG] Loaded existing FAISS index.")
+            return FaissRetriever(index, metadata, embeddings, version=f"{_EMBEDDER_TAG}#{build_id}")
         except Exception as e:
             print(f"[RAG] No usable index found. Rebuilding... ({type(e).__name__}: {e})")
 
     # Download / cache reference files
-    ref_paths = _download_if_needed(REFERENCE_URLS, _REF_DIR)
+    ref_paths = _download_if_needed(REFERENCE_URLS, _REF_DIR, refresh=force_rebuild)
 
     if not any(p.exists() and p.stat().st_size > 0 for p in ref_paths):
         raise RuntimeError(
@@ -163,19 +350,23 @@ def build_or_load_vectorstore(force_rebuild: bool = False):
     if not raw_docs:
         raise RuntimeError("Reference documents could not be loaded. Check files/URLs.")
 
-    chunks = _split_docs(raw_docs)
+    metadata = _split_docs(raw_docs)
 
-    # Build & persist with embeddings
+    # Embed once, persist metadata, build the index (the index file holds the vectors)
     print("[RAG] Computing embeddings and building index...")
-    vs = Chroma.from_texts(
-        texts=[c.page_content for c in chunks],
-        embedding=embeddings,  # <-- pass Embeddings object here too
-        metadatas=[c.metadata for c in chunks],
-        persist_directory=str(_DB_DIR),
-    )
-    vs.persist()
-    print("[RAG] Chroma index built and persisted.")
-    return vs.as_retriever(search_kwargs={"k": 4})
+    vecs = embeddings.encode([m["text"] for m in metadata])
+    faiss.normalize_L2(vecs)
+    build_id = uuid.uuid4().hex
+    table = pa.Table.from_pylist(metadata).replace_schema_metadata({"embedder": _EMBEDDER_TAG, "build_id": build_id})
+    pq.write_table(table, _META_PATH)
+
+    # HNSW graph with inner-product metric (vectors are normalized, so cosine)
+    index = faiss.IndexHNSWFlat(vecs.shape[1], _HNSW_M, faiss.METRIC_INNER_PRODUCT)
+    index.hnsw.efConstruction = _HNSW_EF_CONSTRUCTION
+    index.add(vecs)
+    faiss.write_index(index, str(_INDEX_PATH))
+    print(f"[RAG] FAISS index built and persisted ({index.ntotal} chunks).")
+    return FaissRetriever(index, metadata, embeddings, version=f"{_EMBEDDER_TAG}#{build_id}")
 
 
 if __name__ == "__main__":
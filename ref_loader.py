@@ -0,0 +1,24 @@
+# ref_loader.py
+from pathlib import Path
+from typing import List
+
+import docx2txt
+import fitz  # PyMuPDF
+from langchain_core.documents import Document as LangchainDocument
+
+
+def load_reference_file(p: Path) -> List[LangchainDocument]:
+    # PDF text extraction is CPU-bound inside MuPDF; one document per page
+    docs = []
+    try:
+        if p.suffix.lower() == ".pdf":
+            with fitz.open(str(p)) as d:
+                for i, page in enumerate(d):
+                    docs.append(LangchainDocument(page_content=page.get_text("text"), metadata={"source": str(p), "page": i}))
+        elif p.suffix.lower() == ".docx":
+            docs.append(LangchainDocument(page_content=docx2txt.process(str(p)), metadata={"source": str(p)}))
+        else:
+            print(f"[RAG] Skipping unsupported file type: {p}")
+    except Exception as e:
+        print(f"[RAG] Failed to load {p}: {e}")
+    return docs
@@ -1,7 +1,17 @@
 from pathlib import Path
+from typing import Iterable, Tuple, Any
+import ahocorasick
 
 def ensure_dirs():
     Path("outputs/reviewed").mkdir(parents=True, exist_ok=True)
     Path("outputs/reports").mkdir(parents=True, exist_ok=True)
     Path("data/reference").mkdir(parents=True, exist_ok=True)
     Path("data/samples").mkdir(parents=True, exist_ok=True)
+
+def build_keyword_automaton(pairs: Iterable[Tuple[str, Any]]) -> ahocorasick.Automaton:
+    # One Aho-Corasick automaton over (keyword, tag) pairs; iter() yields (end, (tag, keyword))
+    A = ahocorasick.Automaton()
+    for kw, tag in pairs:
+        A.add_word(kw, (tag, kw))
+    A.make_automaton()
+    return A